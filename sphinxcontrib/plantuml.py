@@ -9,8 +9,9 @@
     :license: BSD, see LICENSE for details.
 """
 
-import codecs
+import base64
 import errno
+import functools
 import hashlib
 import os
 import re
@@ -18,6 +19,7 @@ import shlex
 import shutil
 import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
 from docutils import nodes
@@ -35,12 +37,6 @@ from sphinx.util.osutil import (
     ensuredir,
 )
 
-try:
-    from PIL import Image
-except ImportError:
-    Image = None
-
-
 logger = logging.getLogger(__name__)
 
 
@@ -167,20 +163,15 @@ class UmlDirective(Directive):
 
 
 def _read_utf8(filename):
-    fp = codecs.open(filename, 'rb', 'utf-8')
-    try:
-        return fp.read()
-    finally:
-        fp.close()
+    with open(filename, 'rb') as fp:
+        return fp.read().decode('utf-8')
 
 
 def hash_plantuml_node(node):
-    h = hashlib.sha1()
     # may include different file relative to doc
-    h.update(node['incdir'].encode('utf-8'))
-    h.update(b'\0')
-    h.update(node['uml'].encode('utf-8'))
-    return h.hexdigest()
+    data = b'\0'.join([node['incdir'].encode('utf-8'), node['uml'].encode('utf-8')])
+    # not a security boundary; 160 bits keeps the file names as long as before
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
 
 
 def generate_name(self, node, fileformat):
@@ -212,40 +203,79 @@ def _split_cmdargs(args):
 
 
 _ARGS_BY_FILEFORMAT = {
-    'eps': ['-teps'],
-    'png': [],
-    'svg': ['-tsvg'],
-    'txt': ['-ttxt'],
-    'latex': ['-tlatex:nopreamble'],
+    'eps': ('-teps',),
+    'png': (),
+    'svg': ('-tsvg',),
+    'txt': ('-ttxt',),
+    'latex': ('-tlatex:nopreamble',),
 }
 
 
 def generate_plantuml_args(self, node, fileformat):
-    args = _split_cmdargs(self.builder.config.plantuml)
-    args.extend(['-pipe', '-charset', 'utf-8'])
-    args.extend(['-filename', node['filename']])
+    # reuse the command split once per build
+    args = self.builder.plantuml_builder._base_cmdargs[:]
+    args.extend(['-pipe', '-filename', node['filename']])
     args.extend(_ARGS_BY_FILEFORMAT[fileformat])
     return args
 
 
 def render_plantuml(self, node, fileformat):
     refname, outfname = generate_name(self, node, fileformat)
-    if os.path.exists(outfname):
-        return refname, outfname  # don't regenerate
-
-    cachefname = self.builder.plantuml_builder.render(node, fileformat)
-    ensuredir(os.path.dirname(outfname))
-    # TODO: optionally do symlink/link
-    shutil.copyfile(cachefname, outfname)
+    known_outfnames = self.builder.plantuml_builder.known_outfnames
+    if outfname in known_outfnames:
+        return refname, outfname  # same diagram seen in this build
+
+    # output files are renamed or linked into place, so an existing file is
+    # complete even if it was placed by a concurrent writer process.
+    if not os.path.exists(outfname):  # don't regenerate
+        cachefname = self.builder.plantuml_builder.render(node, fileformat)
+        ensuredir(os.path.dirname(outfname))
+        if self.builder.config.plantuml_cache_hardlink:
+            _link_or_copyfile(cachefname, outfname)
+        else:
+            _copyfile(cachefname, outfname)
+    known_outfnames.add(outfname)
     return refname, outfname
 
 
+def _copyfile(src, dst):
+    # copy to temp file and rename so a partial file is never left behind,
+    # which would be taken as rendered by the next build or by concurrent
+    # writer process.
+    dstdir, basename = os.path.split(dst)
+    with tempfile.NamedTemporaryFile(
+        prefix=basename + '.new', dir=dstdir, delete=False
+    ) as f:
+        try:
+            with open(src, 'rb') as fsrc:
+                shutil.copyfileobj(fsrc, f)
+            # inherit dir mode since temp file isn't world-readable by default.
+            if os.name == 'posix':
+                os.fchmod(f.fileno(), os.lstat(dstdir).st_mode & 0o666)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    rename(f.name, dst)
+
+
+def _link_or_copyfile(src, dst):
+    # cached files are never modified in place (they are replaced by rename),
+    # so the output file can share the inode with the cache.
+    try:
+        os.link(src, dst)
+    except OSError as err:
+        if err.errno == errno.EEXIST:
+            return  # placed by concurrent writer process
+        _copyfile(src, dst)
+
+
 def render_plantuml_inline(self, node, fileformat):
     absincdir = os.path.join(self.builder.srcdir, node['incdir'])
     try:
-        p = subprocess.Popen(
+        p = subprocess.run(
             generate_plantuml_args(self, node, fileformat),
-            stdin=subprocess.PIPE,
+            input=node['uml'].encode('utf-8'),
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             cwd=absincdir,
@@ -256,19 +286,19 @@ def render_plantuml_inline(self, node, fileformat):
         raise PlantUmlError(
             'plantuml command %r cannot be run' % self.builder.config.plantuml
         )
-    sout, serr = p.communicate(node['uml'].encode('utf-8'))
     if p.returncode != 0:
-        raise PlantUmlError('error while running plantuml\n\n%s' % serr)
-    return sout.decode('utf-8')
+        raise PlantUmlError('error while running plantuml\n\n%s' % p.stderr)
+    return p.stdout.decode('utf-8')
 
 
 class PlantumlBuilder(object):
-    def __init__(self, builder):
+    def __init__(self, builder, jobs=1):
         # for compatibility with existing functions which expect self.builder
         # TODO: remove self.builder
         self.builder = builder
 
         self.batch_size = builder.config.plantuml_batch_size
+        self.jobs = max(jobs, 1)
         self.cache_dir = os.path.join(
             builder.outdir, builder.config.plantuml_cache_path
         )
@@ -288,15 +318,33 @@ class PlantumlBuilder(object):
                 fileformat, _postproc = _lookup_latex_format(fmt)
                 self.image_formats = [fileformat]
 
-        self._known_keys = set()
-        self._pending_keys = []
+        # output files known to exist, which may be shared by multiple nodes
+        self.known_outfnames = set()
+        self._known_cachefnames = set()
+        self._known_keys = set()  # {(key, fileformat), ...}
+        self._pending_keys = {}  # {fileformat: [key, ...], ...}
+
+    def _node_image_formats(self, node):
+        # per-node format overrides the configuration
+        if self.builder.format == 'html' and 'html_format' in node:
+            fileformats, _gettag = _lookup_html_format(node['html_format'])
+            return list(fileformats)
+        elif self.builder.format == 'latex' and 'latex_format' in node:
+            fileformat, _postproc = _lookup_latex_format(node['latex_format'])
+            return [fileformat]
+        return self.image_formats
 
     def collect_nodes(self, doctree):
         for node in doctree.traverse(plantuml):
             key = hash_plantuml_node(node)
-            if key in self._known_keys:
+            fileformats = [
+                fmt
+                for fmt in self._node_image_formats(node)
+                if (key, fmt) not in self._known_keys
+            ]
+            if not fileformats:
                 continue
-            self._known_keys.add(key)
+            self._known_keys.update((key, fmt) for fmt in fileformats)
 
             doc = node['uml'].encode('utf-8')
             if b'!include' in doc or b'%filename' in doc:
@@ -306,10 +354,12 @@ class PlantumlBuilder(object):
 
             outdir = os.path.join(self.cache_dir, key[:2])
             outfbase = os.path.join(outdir, key)
-            if all(
-                os.path.exists('%s.%s' % (outfbase, sfx))
-                for sfx in ['puml'] + self.image_formats
-            ):
+            fileformats = [
+                fmt
+                for fmt in fileformats
+                if not os.path.exists('%s.%s' % (outfbase, fmt))
+            ]
+            if not fileformats and os.path.exists(outfbase + '.puml'):
                 continue
 
             ensuredir(outdir)
@@ -324,7 +374,17 @@ class PlantumlBuilder(object):
                 if not started:
                     f.write(b'\n@enduml\n')
 
-            self._pending_keys.append(key)
+            for fmt in fileformats:
+                self._pending_keys.setdefault(fmt, []).append(key)
+
+    def _map(self, func, iterable):
+        if self.jobs == 1:
+            return list(map(func, iterable))
+        # plantuml processes don't hold the GIL, so threads suffice. The pool
+        # is shut down on return so no thread is left running when Sphinx
+        # forks writer processes.
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(func, iterable))
 
     def render_batches(self):
         if sphinx.version_info[:2] >= (6, 1):
@@ -332,90 +392,193 @@ class PlantumlBuilder(object):
         else:
             from sphinx.util import progress_message
 
-        pending_keys = sorted(self._pending_keys)
-        for fileformat in self.image_formats:
+        batches = []  # [(fileformat, keys, start, total), ...]
+        for fileformat, keys in sorted(self._pending_keys.items()):
+            pending_keys = sorted(keys)
             for i in range(0, len(pending_keys), self.batch_size):
                 keys = pending_keys[i : i + self.batch_size]
+                batches.append((fileformat, keys, i, len(pending_keys)))
 
+        if self.jobs > 1 and len(batches) > 1:
+            with progress_message(
+                'rendering plantuml diagrams [%d batches]' % len(batches)
+            ):
+                self._map(lambda b: self._render_files(b[1], b[0]), batches)
+        else:
+            for fileformat, keys, i, total in batches:
                 with progress_message(
                     'rendering plantuml diagrams [%d..%d/%d]'
-                    % (i, i + len(keys), len(pending_keys))
+                    % (i, i + len(keys), total)
                 ):
                     self._render_files(keys, fileformat)
 
-        del self._pending_keys[:]
+        self._pending_keys.clear()
+
+    def render_nodes(self, doctree):
+        """Render diagrams of the doctree concurrently prior to visiting nodes"""
+        pending = {}  # {(key, fileformat): node, ...}
+        for node in doctree.traverse(plantuml):
+            key = hash_plantuml_node(node)
+            for fmt in self._node_image_formats(node):
+                pending.setdefault((key, fmt), node)
+
+        def render(item):
+            (_key, fileformat), node = item
+            try:
+                self.render(node, fileformat)
+            except PlantUmlError:
+                pass  # will be reported by the node visitor
+
+        self._map(render, pending.items())
 
     def _render_files(self, keys, fileformat):
         cmdargs = self._base_cmdargs[:]
         cmdargs.extend(_ARGS_BY_FILEFORMAT[fileformat])
         cmdargs.extend(os.path.join(k[:2], '%s.puml' % k) for k in keys)
         try:
-            p = subprocess.Popen(cmdargs, stderr=subprocess.PIPE, cwd=self.cache_dir)
+            p = subprocess.run(cmdargs, stderr=subprocess.PIPE, cwd=self.cache_dir)
         except OSError as err:
             if err.errno != errno.ENOENT:
                 raise
             raise PlantUmlError(
                 'plantuml command %r cannot be run' % self.builder.config.plantuml
             )
-        serr = p.communicate()[1]
         if p.returncode != 0:
             if self.builder.config.plantuml_syntax_error_image:
                 logger.warning(
-                    'error while running plantuml\n\n%s' % serr, type='plantuml'
+                    'error while running plantuml\n\n%s' % p.stderr, type='plantuml'
                 )
             else:
-                raise PlantUmlError('error while running plantuml\n\n%s' % serr)
+                raise PlantUmlError('error while running plantuml\n\n%s' % p.stderr)
 
-    def render(self, node, fileformat):
+    def _get_cache_fname(self, node, fileformat):
         key = hash_plantuml_node(node)
-        outdir = os.path.join(self.cache_dir, key[:2])
-        basename = '%s.%s' % (key, fileformat)
-        outfname = os.path.join(outdir, basename)
+        return os.path.join(self.cache_dir, key[:2], '%s.%s' % (key, fileformat))
+
+    def is_cached(self, node, fileformat):
+        outfname = self._get_cache_fname(node, fileformat)
+        if outfname in self._known_cachefnames:
+            return True
         if os.path.exists(outfname):
+            self._known_cachefnames.add(outfname)
+            return True
+        return False
+
+    def render(self, node, fileformat):
+        outfname = self._get_cache_fname(node, fileformat)
+        if self.is_cached(node, fileformat):
             return outfname
+        outdir, basename = os.path.split(outfname)
 
-        ensuredir(outdir)
         absincdir = os.path.join(self.builder.srcdir, node['incdir'])
+        try:
+            p = subprocess.run(
+                generate_plantuml_args(self, node, fileformat),
+                input=node['uml'].encode('utf-8'),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=absincdir,
+            )
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            raise PlantUmlError(
+                'plantuml command %r cannot be run' % self.builder.config.plantuml
+            )
+        if p.returncode != 0:
+            if self.builder.config.plantuml_syntax_error_image:
+                logger.warning(
+                    'error while running plantuml\n\n%s' % p.stderr,
+                    location=node,
+                    type='plantuml',
+                )
+            else:
+                raise PlantUmlError('error while running plantuml\n\n%s' % p.stderr)
+
+        # write to temp file and rename so a partial file is never left behind
+        ensuredir(outdir)
         # TODO: delete_on_close can be used on Python 3.12+
         with tempfile.NamedTemporaryFile(
             prefix=basename + '.new', dir=outdir, delete=False
         ) as f:
-            try:
-                p = subprocess.Popen(
-                    generate_plantuml_args(self, node, fileformat),
-                    stdout=f,
-                    stdin=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    cwd=absincdir,
-                )
-            except OSError as err:
-                if err.errno != errno.ENOENT:
-                    raise
-                raise PlantUmlError(
-                    'plantuml command %r cannot be run' % self.builder.config.plantuml
-                )
-            serr = p.communicate(node['uml'].encode('utf-8'))[1]
-            if p.returncode != 0:
-                if self.builder.config.plantuml_syntax_error_image:
-                    logger.warning(
-                        'error while running plantuml\n\n%s' % serr,
-                        location=node,
-                        type='plantuml',
-                    )
-                else:
-                    raise PlantUmlError('error while running plantuml\n\n%s' % serr)
-
+            f.write(p.stdout)
             # inherit dir mode since temp file isn't world-readable by default.
             if os.name == 'posix':
                 os.fchmod(f.fileno(), os.lstat(outdir).st_mode & 0o666)
-            f.close()
-            rename(f.name, outfname)
+        rename(f.name, outfname)
 
+        self._known_cachefnames.add(outfname)
         return outfname
 
 
-def _render_batches_on_vist(self):
-    self.builder.plantuml_builder.render_batches()
+@functools.lru_cache(maxsize=None)
+def _import_pil_image():
+    # PIL is only needed to scale images, so don't load it at startup.
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+@functools.lru_cache(maxsize=4096)
+def _get_png_size(fname):
+    # file name is derived from the content hash, so the size never changes.
+    # it's parsed from the header; no need to decode pixels.
+    with _import_pil_image().open(fname) as im:
+        return im.size
+
+
+_VALUE_UNITS_RE = re.compile(r"(?P<value>\d+)\s*(?P<units>[a-zA-Z%]+)?")
+_SVG_TAG_RE = re.compile(rb'<svg\b([^<>]+)>')
+_SVG_STYLE_RE = re.compile(rb'\bstyle=[\'"]([^\'"]+)')
+
+
+_MIMETYPES_BY_FILEFORMAT = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _get_data_uri(fname, fileformat):
+    # file name is derived from the content hash, so the data never changes
+    with open(fname, 'rb') as f:
+        data = base64.b64encode(f.read()).decode('ascii')
+    return 'data:%s;base64,%s' % (_MIMETYPES_BY_FILEFORMAT[fileformat], data)
+
+
+def _render_html_image(self, node, fileformat):
+    max_size = self.builder.config.plantuml_embed_max_size
+    if max_size > 0:
+        cachefname = self.builder.plantuml_builder.render(node, fileformat)
+        if os.path.getsize(cachefname) <= max_size:
+            return _get_data_uri(cachefname, fileformat), cachefname
+    return render_plantuml(self, node, fileformat)
+
+
+def _is_html_image_missing(self, node, fileformat):
+    plantuml_builder = self.builder.plantuml_builder
+    if self.builder.config.plantuml_embed_max_size <= 0:
+        refname, outfname = generate_name(self, node, fileformat)
+        if outfname in plantuml_builder.known_outfnames or os.path.exists(outfname):
+            return False
+    return not plantuml_builder.is_cached(node, fileformat)
+
+
+def _render_html_images(self, node, fileformats):
+    # with -j N, images have been rendered at doctree-resolved.
+    if self.builder.plantuml_builder.jobs > 1 or len(fileformats) == 1:
+        return [_render_html_image(self, node, e) for e in fileformats]
+    missing = [e for e in fileformats if _is_html_image_missing(self, node, e)]
+    if len(missing) < 2:
+        return [_render_html_image(self, node, e) for e in fileformats]
+    # plantuml can't emit multiple formats at once, but the startup time of
+    # the processes can be overlapped.
+    with ThreadPoolExecutor(max_workers=len(fileformats)) as executor:
+        return list(
+            executor.map(lambda e: _render_html_image(self, node, e), fileformats)
+        )
 
 
 def _get_png_tag(self, fnames, node):
@@ -425,7 +588,8 @@ def _get_png_tag(self, fnames, node):
     # mimic StandaloneHTMLBuilder.post_process_images(). maybe we should
     # process images prior to html_vist.
     scale_attrs = [k for k in ('scale', 'width', 'height') if k in node]
-    if scale_attrs and Image is None:
+    pil_image = _import_pil_image() if scale_attrs else None
+    if scale_attrs and pil_image is None:
         logger.warning(
             (
                 'plantuml: unsupported scaling attributes: %s '
@@ -434,18 +598,17 @@ def _get_png_tag(self, fnames, node):
             location=node,
             type='plantuml',
         )
-    if not scale_attrs or Image is None:
+    if not scale_attrs or pil_image is None:
         return '<img src="%s" alt="%s"/>\n' % (self.encode(refname), self.encode(alt))
 
     scale = node.get('scale', 100)
     styles = []
 
     # Width/Height
-    vu = re.compile(r"(?P<value>\d+)\s*(?P<units>[a-zA-Z%]+)?")
     for a in ['width', 'height']:
         if a not in node:
             continue
-        m = vu.match(node[a])
+        m = _VALUE_UNITS_RE.match(node[a])
         if not m:
             raise PlantUmlError('Invalid %s' % a)
         m = m.groupdict()
@@ -458,11 +621,9 @@ def _get_png_tag(self, fnames, node):
         # the image may be corrupted if platuml isn't configured correctly,
         # which isn't a hard error.
         try:
-            im = Image.open(outfname)
-            im.load()
             styles.extend(
                 '%s: %s%s' % (a, w * scale / 100, 'px')
-                for a, w in zip(['width', 'height'], im.size)
+                for a, w in zip(['width', 'height'], _get_png_size(outfname))
             )
         except (IOError, OSError) as err:
             logger.warning(
@@ -471,6 +632,13 @@ def _get_png_tag(self, fnames, node):
                 type='plantuml',
             )
 
+    if refname.startswith('data:'):
+        # embedded image can't be opened by link
+        return '<img src="%s" alt="%s" style="%s"/>\n' % (
+            self.encode(refname),
+            self.encode(alt),
+            self.encode('; '.join(styles)),
+        )
     return '<a href="%s"><img src="%s" alt="%s" style="%s"/>' '</a>\n' % (
         self.encode(refname),
         self.encode(refname),
@@ -480,22 +648,24 @@ def _get_png_tag(self, fnames, node):
 
 
 def _get_svg_style(fname):
-    f = codecs.open(fname, 'r', 'utf-8')
-    try:
-        for l in f:
-            m = re.search(r'<svg\b([^<>]+)', l)
+    # <svg> tag should be found in the first chunk, but don't read the whole
+    # file line by line since plantuml may generate a single-line document.
+    head = b''
+    with open(fname, 'rb') as f:
+        while True:
+            chunk = f.read(4096)
+            if not chunk:
+                return
+            head += chunk
+            m = _SVG_TAG_RE.search(head)
             if m:
                 attrs = m.group(1)
                 break
-        else:
-            return
-    finally:
-        f.close()
 
-    m = re.search(r'\bstyle=[\'"]([^\'"]+)', attrs)
+    m = _SVG_STYLE_RE.search(attrs)
     if not m:
         return
-    return m.group(1)
+    return m.group(1).decode('utf-8')
 
 
 def _svg_get_style_str(node, outfname):
@@ -573,7 +743,6 @@ def _prepare_html_render(self, fmt, node):
 
 
 def html_visit_plantuml(self, node):
-    _render_batches_on_vist(self)
     if 'html_format' in node:
         fmt = node['html_format']
     else:
@@ -581,7 +750,7 @@ def html_visit_plantuml(self, node):
 
     with _prepare_html_render(self, fmt, node) as (fileformats, gettag):
         # fnames: {fileformat: (refname, outfname), ...}
-        fnames = dict((e, render_plantuml(self, node, e)) for e in fileformats)
+        fnames = dict(zip(fileformats, _render_html_images(self, node, fileformats)))
 
     self.body.append(self.starttag(node, 'p', CLASS='plantuml'))
     self.body.append(gettag(self, fnames, node))
@@ -670,7 +839,6 @@ def _latex_add_package(self, package):
 
 
 def latex_visit_plantuml(self, node):
-    _render_batches_on_vist(self)
     if 'latex_format' in node:
         fmt = node['latex_format']
     else:
@@ -700,8 +868,8 @@ def latex_visit_plantuml(self, node):
             self.body.append(input_macro)
     else:
         # put node representing rendered image
-        img_node = nodes.image(uri=refname, **node.attributes)
-        img_node.delattr('uml')
+        attrs = dict((k, v) for k, v in node.attributes.items() if k != 'uml')
+        img_node = nodes.image(uri=refname, **attrs)
         if not img_node.hasattr('alt'):
             img_node['alt'] = node['uml']
         node.append(img_node)
@@ -718,7 +886,6 @@ _KNOWN_CONFLUENCE_FORMATS = [
 
 
 def confluence_visit_plantuml(self, node):
-    _render_batches_on_vist(self)
     fmt = self.builder.config.plantuml_output_format
     if fmt == 'none':
         raise nodes.SkipNode
@@ -742,7 +909,6 @@ def confluence_depart_plantuml(self, node):
 
 
 def text_visit_plantuml(self, node):
-    _render_batches_on_vist(self)
     try:
         text = render_plantuml_inline(self, node, 'txt')
     except PlantUmlError as err:
@@ -756,7 +922,6 @@ def text_visit_plantuml(self, node):
 
 
 def pdf_visit_plantuml(self, node):
-    _render_batches_on_vist(self)
     try:
         _, outfname = render_plantuml(self, node, 'svg')
     except PlantUmlError as err:
@@ -787,7 +952,7 @@ _NODE_VISITORS = {
 
 
 def _on_builder_inited(app):
-    app.builder.plantuml_builder = PlantumlBuilder(app.builder)
+    app.builder.plantuml_builder = PlantumlBuilder(app.builder, jobs=app.parallel)
 
 
 def _on_doctree_read(app, doctree):
@@ -798,11 +963,16 @@ def _on_doctree_read(app, doctree):
 
 def _on_doctree_resolved(app, doctree, docname):
     # Dynamically generated nodes will be collected here, which will be
-    # batched at node visitor. Since 'doctree-resolved' and node visits
+    # batched prior to node visits. Since 'doctree-resolved' and node visits
     # can be intermixed, there's no way to batch rendering of dynamic nodes
     # at once.
-    if app.builder.plantuml_builder.batch_size > 1:
-        app.builder.plantuml_builder.collect_nodes(doctree)
+    plantuml_builder = app.builder.plantuml_builder
+    if plantuml_builder.batch_size > 1:
+        plantuml_builder.collect_nodes(doctree)
+        plantuml_builder.render_batches()
+    # Render the remainder (e.g. diagrams using !include) concurrently.
+    if plantuml_builder.jobs > 1:
+        plantuml_builder.render_nodes(doctree)
 
 
 def setup(app):
@@ -819,7 +989,9 @@ def setup(app):
     app.add_config_value('plantuml_latex_output_format', 'png', '')
     app.add_config_value('plantuml_syntax_error_image', False, '')
     app.add_config_value('plantuml_cache_path', '_plantuml', '')
+    app.add_config_value('plantuml_cache_hardlink', False, '')
     app.add_config_value('plantuml_batch_size', 1, '')
+    app.add_config_value('plantuml_embed_max_size', 0, 'html')
     app.connect('builder-inited', _on_builder_inited)
     app.connect('doctree-read', _on_doctree_read)
     app.connect('doctree-resolved', _on_doctree_resolved)
@@ -830,4 +1002,4 @@ def setup(app):
 
         setattr(translator, 'visit_' + plantuml.__name__, pdf_visit_plantuml)
 
-    return {'parallel_read_safe': True}
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
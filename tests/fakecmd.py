@@ -12,9 +12,13 @@ def dump(fout, fin):
 if '-pipe' in sys.argv:
     dump(sys.stdout, sys.stdin)
 else:
+    fileext = '.png'
+    for arg in sys.argv[1:]:
+        if arg.startswith('-t'):
+            fileext = '.' + arg[2:].split(':')[0]
     for fname in sys.argv[1:]:
         if not fname.endswith('.puml'):
             continue
-        with open(fname[:-5] + '.png', 'w') as fout:
+        with open(fname[:-5] + fileext, 'w') as fout:
             with open(fname, 'r') as fin:
                 dump(fout, fin)
@@ -1,4 +1,3 @@
-import glob
 import inspect
 import os
 import re
@@ -6,19 +5,19 @@ import tempfile
 import shutil
 import sys
 import unittest
+from pathlib import Path
 
-from sphinx.application import Sphinx
+_testdir = os.path.dirname(__file__)
+_fixturedir = os.path.join(_testdir, 'fixture')
+_fakecmd = os.path.join(_testdir, 'fakecmd.py')
 
-_fixturedir = os.path.join(os.path.dirname(__file__), 'fixture')
-_fakecmd = os.path.join(os.path.dirname(__file__), 'fakecmd.py')
+_includegraphics_re = re.compile(br'\\(sphinx)?includegraphics\{+plantuml-')
 
 
 def setup_module():
-    global _tempdir, _srcdir, _outdir
+    global _tempdir, _cachedir
     _tempdir = tempfile.mkdtemp()
-    _srcdir = os.path.join(_tempdir, 'src')
-    _outdir = os.path.join(_tempdir, 'out')
-    os.mkdir(_srcdir)
+    _cachedir = os.path.join(_tempdir, '_plantuml')
 
 
 def teardown_module():
@@ -26,44 +25,67 @@ def teardown_module():
 
 
 def readfile(fname):
-    f = open(os.path.join(_outdir, fname), 'rb')
-    try:
-        return f.read()
-    finally:
-        f.close()
-
-
-def runsphinx(text, builder, confoverrides):
-    f = open(os.path.join(_srcdir, 'index.rst'), 'wb')
-    try:
-        f.write(text.encode('utf-8'))
-    finally:
-        f.close()
+    return Path(_outdir, fname).read_bytes()
+
+
+def readhead(fname):
+    # command and first line of the fake plantuml output
+    return tuple(readfile(fname).split(b'\n', 2)[:2])
+
+
+def list_images(subdir, ext):
+    with os.scandir(os.path.join(_outdir, subdir)) as it:
+        return [e.path for e in it
+                if e.name.startswith('plantuml-') and e.name.endswith(ext)]
+
+
+def list_cache_files(ext):
+    files = []
+    with os.scandir(os.path.join(_outdir, '_plantuml')) as it:
+        for d in it:
+            if not d.is_dir():
+                continue
+            with os.scandir(d.path) as it2:
+                files.extend(e.path for e in it2 if e.name.endswith(ext))
+    return files
+
+
+def runsphinx(text, builder, confoverrides, parallel=0):
+    # deferred so that collecting tests doesn't load all of Sphinx
+    from sphinx.application import Sphinx
+
+    Path(_srcdir, 'index.rst').write_bytes(text.encode('utf-8'))
     app = Sphinx(_srcdir, _fixturedir, _outdir, _outdir, builder,
-                 confoverrides, status=sys.stdout, warning=sys.stdout)
+                 confoverrides, status=sys.stdout, warning=sys.stdout,
+                 parallel=parallel)
     app.build()
 
 
-def with_runsphinx(builder, **kwargs):
-    confoverrides = {'plantuml': [sys.executable, _fakecmd]}
+def with_runsphinx(builder, parallel=0, **kwargs):
+    # fakecmd.py needs no site packages; -S makes it start several times faster
+    confoverrides = {'plantuml': [sys.executable, '-S', _fakecmd]}
     confoverrides.update(kwargs)
 
     def wrapfunc(func):
+        src = ''.join(inspect.getdoc(func).splitlines(keepends=True)[2:])
+
         def test():
+            global _srcdir, _outdir
             if builder == 'pdf':
                 try:
                     import rst2pdf
                     rst2pdf.__file__
                 except ImportError:
                     raise unittest.SkipTest
-            src = ''.join(inspect.getdoc(func).splitlines(keepends=True)[2:])
-            os.mkdir(_outdir)
-            try:
-                runsphinx(src, builder, confoverrides)
-                func()
-            finally:
-                os.unlink(os.path.join(_srcdir, 'index.rst'))
-                shutil.rmtree(_outdir)
+            # fresh directories per test, which are removed at teardown_module
+            _srcdir = tempfile.mkdtemp(dir=_tempdir)
+            _outdir = tempfile.mkdtemp(dir=_tempdir)
+            # share renderings across tests unless the test inspects its
+            # own cache directory
+            overrides = dict(confoverrides)
+            overrides.setdefault('plantuml_cache_path', _cachedir)
+            runsphinx(src, builder, overrides, parallel)
+            func()
         test.__name__ = func.__name__
         return test
 
@@ -78,31 +100,87 @@ def test_buildhtml_simple_with_svg():
 
        Hello
     """
-    pngfiles = glob.glob(os.path.join(_outdir, '_images', 'plantuml-*.png'))
+    pngfiles = list_images('_images', '.png')
     assert len(pngfiles) == 1
-    svgfiles = glob.glob(os.path.join(_outdir, '_images', 'plantuml-*.svg'))
+    svgfiles = list_images('_images', '.svg')
     assert len(svgfiles) == 1
 
-    assert b'<img src="_images/plantuml' in readfile('index.html')
-    assert b'<object data="_images/plantuml' in readfile('index.html')
+    html = readfile('index.html')
+    assert b'<img src="_images/plantuml' in html
+    assert b'<object data="_images/plantuml' in html
+
+    pngcmd, pngline = readhead(pngfiles[0])
+    assert b'-pipe' in pngcmd
+    assert pngline[2:] == b'Hello'
+    svgcmd, svgline = readhead(svgfiles[0])
+    assert b'-tsvg' in svgcmd
+    assert svgline[2:] == b'Hello'
+
+
+@with_runsphinx('html', plantuml_cache_path='_plantuml',
+                plantuml_cache_hardlink=True)
+def test_buildhtml_shares_cached_file():
+    """Output image should be linked to the cached file
+
+    .. uml::
+
+       Hello
+    """
+    files = list_images('_images', '.png')
+    assert len(files) == 1
+    key = os.path.basename(files[0])[len('plantuml-'):-len('.png')]
+    cachefname = os.path.join(_outdir, '_plantuml', key[:2], key + '.png')
+    assert os.path.samefile(files[0], cachefname)
+
 
-    pngcontent = readfile(pngfiles[0]).splitlines()
-    assert b'-pipe' in pngcontent[0]
-    assert pngcontent[1][2:] == b'Hello'
-    svgcontent = readfile(svgfiles[0]).splitlines()
-    assert b'-tsvg' in svgcontent[0]
-    assert svgcontent[1][2:] == b'Hello'
+@with_runsphinx('html', parallel=2, plantuml_output_format='svg',
+                plantuml_cache_path='_plantuml')
+def test_buildhtml_parallel():
+    """Generate HTML in parallel
 
+    .. uml::
 
-@with_runsphinx('html', plantuml_output_format='none')
-def test_buildhtml_no_output():
-    """Generate simple HTML with uml directive disabled
+       Hello
+
+    .. uml::
+
+       Hello!
+    """
+    pngfiles = list_images('_images', '.png')
+    assert len(pngfiles) == 2
+    svgfiles = list_images('_images', '.svg')
+    assert len(svgfiles) == 2
+    imgtags = [l for l in readfile('index.html').splitlines()
+               if b'<img src="_images/plantuml' in l]
+    assert len(imgtags) == 2
+
+
+@with_runsphinx('html', plantuml_output_format='svg',
+                plantuml_embed_max_size=1024)
+def test_buildhtml_embed():
+    """Generate HTML with embedded images
+
+    .. uml::
+
+       Hello
+    """
+    assert not os.path.exists(os.path.join(_outdir, '_images'))
+    html = readfile('index.html')
+    assert b'<object data="data:image/svg+xml;base64,' in html
+    assert b'<img src="data:image/png;base64,' in html
+
+
+@with_runsphinx('html', plantuml_embed_max_size=1)
+def test_buildhtml_embed_too_large():
+    """Generate HTML with images too large to embed
 
     .. uml::
 
        Hello
     """
-    assert b'<img ' not in readfile('index.html')
+    files = list_images('_images', '.png')
+    assert len(files) == 1
+    assert b'<img src="_images/plantuml' in readfile('index.html')
 
 
 @with_runsphinx('html')
@@ -117,7 +195,7 @@ def test_buildhtml_samediagram():
 
        Hello
     """
-    files = glob.glob(os.path.join(_outdir, '_images', 'plantuml-*.png'))
+    files = list_images('_images', '.png')
     assert len(files) == 1
     imgtags = [l for l in readfile('index.html').splitlines()
                if b'<img src="_images/plantuml' in l]
@@ -136,6 +214,19 @@ def test_buildhtml_alt():
     assert b'alt="Foo &lt;Bar&gt;"' in readfile('index.html')
 
 
+@with_runsphinx('html')
+def test_buildhtml_width():
+    """Generate HTML with width specified
+
+    .. uml::
+       :width: 50px
+       :scale: 50%
+
+       Hello
+    """
+    assert b'style="width: 25.0px"' in readfile('index.html')
+
+
 @with_runsphinx('html')
 def test_buildhtml_caption():
     """Generate HTML with caption specified
@@ -170,13 +261,14 @@ def test_buildhtml_nonascii():
 
        \u3042
     """
-    files = glob.glob(os.path.join(_outdir, '_images', 'plantuml-*.png'))
-    content = readfile(files[0]).splitlines()
-    assert b'-charset utf-8' in content[0]
-    assert content[1][2:].decode('utf-8') == u'\u3042'
+    files = list_images('_images', '.png')
+    cmd, line = readhead(files[0])
+    assert b'-charset utf-8' in cmd
+    assert line[2:].decode('utf-8') == u'\u3042'
 
 
-@with_runsphinx('html', plantuml_batch_size=2)
+@with_runsphinx('html', plantuml_batch_size=2,
+                plantuml_cache_path='_plantuml')
 def test_buildhtml_in_batches():
     """Render in batches
 
@@ -198,7 +290,7 @@ def test_buildhtml_in_batches():
 
        !include seq.ja.uml
     """
-    puml_files = glob.glob(os.path.join(_outdir, '_plantuml', '*', '*.puml'))
+    puml_files = list_cache_files('.puml')
     assert len(puml_files) == 3
     puml_contents = [readfile(f).splitlines() for f in puml_files]
     assert all(len(lines) == 3 for lines in puml_contents)
@@ -208,13 +300,59 @@ def test_buildhtml_in_batches():
             == [b'Hello', b'Hello!', b'Hello!!'])
 
     # batches: [2, 1], excluded: 1
-    png_files = glob.glob(os.path.join(_outdir, '_plantuml', '*', '*.png'))
+    png_files = list_cache_files('.png')
     assert len(png_files) == 4
-    png_commands = [readfile(f).splitlines()[0] for f in png_files]
-    assert len(set(png_commands)) == 3
-    assert sum(b'-pipe' in cmd for cmd in set(png_commands)) == 1
+    png_commands = {readhead(f)[0] for f in png_files}
+    assert len(png_commands) == 3
+    assert sum(b'-pipe' in cmd for cmd in png_commands) == 1
     assert sorted(sum(c.endswith(b'.puml') for c in cmd.split())
-                  for cmd in set(png_commands)) == [0, 1, 2]
+                  for cmd in png_commands) == [0, 1, 2]
+
+
+@with_runsphinx('html', plantuml_batch_size=2,
+                plantuml_cache_path='_plantuml')
+def test_buildhtml_in_batches_with_html_format():
+    """Render in batches with per-node html_format
+
+    .. uml::
+       :html_format: svg_img
+
+       Hello
+    """
+    png_files = list_cache_files('.png')
+    assert len(png_files) == 0
+    svg_files = list_cache_files('.svg')
+    assert len(svg_files) == 1
+    svgcmd = readhead(svg_files[0])[0]
+    assert b'-pipe' not in svgcmd
+    assert b'-tsvg' in svgcmd
+
+
+@with_runsphinx('html', parallel=2, plantuml_batch_size=2,
+                plantuml_cache_path='_plantuml')
+def test_buildhtml_in_batches_parallel():
+    """Render batches concurrently
+
+    .. uml::
+
+       Hello
+
+    .. uml::
+
+       Hello!
+
+    .. uml::
+
+       Hello!!
+    """
+    # batches: [2, 1]
+    png_files = list_cache_files('.png')
+    assert len(png_files) == 3
+    png_commands = {readhead(f)[0] for f in png_files}
+    assert not any(b'-pipe' in cmd for cmd in png_commands)
+    assert sorted(sum(c.endswith(b'.puml') for c in cmd.split())
+                  for cmd in png_commands) == [1, 2]
+    assert len(list_images('_images', '.png')) == 3
 
 
 @with_runsphinx('latex')
@@ -225,14 +363,13 @@ def test_buildlatex_simple():
 
        Hello
     """
-    files = glob.glob(os.path.join(_outdir, 'plantuml-*.png'))
+    files = list_images('', '.png')
     assert len(files) == 1
-    assert re.search(br'\\(sphinx)?includegraphics\{+plantuml-',
-                     readfile('plantuml_fixture.tex'))
+    assert _includegraphics_re.search(readfile('plantuml_fixture.tex'))
 
-    content = readfile(files[0]).splitlines()
-    assert b'-pipe' in content[0]
-    assert content[1][2:] == b'Hello'
+    cmd, line = readhead(files[0])
+    assert b'-pipe' in cmd
+    assert line[2:] == b'Hello'
 
 
 @with_runsphinx('latex', plantuml_latex_output_format='eps')
@@ -243,14 +380,13 @@ def test_buildlatex_simple_with_eps():
 
        Hello
     """
-    files = glob.glob(os.path.join(_outdir, 'plantuml-*.eps'))
+    files = list_images('', '.eps')
     assert len(files) == 1
-    assert re.search(br'\\(sphinx)?includegraphics\{+plantuml-',
-                     readfile('plantuml_fixture.tex'))
+    assert _includegraphics_re.search(readfile('plantuml_fixture.tex'))
 
-    content = readfile(files[0]).splitlines()
-    assert b'-teps' in content[0]
-    assert content[1][2:] == b'Hello'
+    cmd, line = readhead(files[0])
+    assert b'-teps' in cmd
+    assert line[2:] == b'Hello'
 
 
 @with_runsphinx('latex', plantuml_latex_output_format='tikz')
@@ -261,14 +397,14 @@ def test_buildlatex_simple_with_tikz():
 
        Hello
     """
-    files = glob.glob(os.path.join(_outdir, 'plantuml-*.latex'))
+    files = list_images('', '.latex')
     assert len(files) == 1
     assert re.search(br'\\input\{+plantuml-',
                      readfile('plantuml_fixture.tex'))
 
-    content = readfile(files[0]).splitlines()
-    assert b'-tlatex:nopreamble' in content[0]
-    assert content[1][2:] == b'Hello'
+    cmd, line = readhead(files[0])
+    assert b'-tlatex:nopreamble' in cmd
+    assert line[2:] == b'Hello'
 
 
 @with_runsphinx('latex', plantuml_latex_output_format='tikz')
@@ -331,28 +467,15 @@ def test_buildlatex_simple_with_pdf():
 
        Hello
     """
-    epsfiles = glob.glob(os.path.join(_outdir, 'plantuml-*.eps'))
-    pdffiles = glob.glob(os.path.join(_outdir, 'plantuml-*.pdf'))
+    epsfiles = list_images('', '.eps')
+    pdffiles = list_images('', '.pdf')
     assert len(epsfiles) == 1
     assert len(pdffiles) == 1
-    assert re.search(br'\\(sphinx)?includegraphics\{+plantuml-',
-                     readfile('plantuml_fixture.tex'))
-
-    epscontent = readfile(epsfiles[0]).splitlines()
-    assert b'-teps' in epscontent[0]
-    assert epscontent[1][2:] == b'Hello'
-
+    assert _includegraphics_re.search(readfile('plantuml_fixture.tex'))
 
-@with_runsphinx('latex', plantuml_latex_output_format='none')
-def test_buildlatex_no_output():
-    """Generate simple LaTeX with uml directive disabled
-
-    .. uml::
-
-       Hello
-    """
-    assert not re.search(br'\\(sphinx)?includegraphics\{+plantuml-',
-                         readfile('plantuml_fixture.tex'))
+    epscmd, epsline = readhead(epsfiles[0])
+    assert b'-teps' in epscmd
+    assert epsline[2:] == b'Hello'
 
 
 @with_runsphinx('latex')
@@ -392,11 +515,11 @@ def test_buildpdf_simple():
 
        Hello
     """
-    epsfiles = glob.glob(os.path.join(_outdir, 'plantuml-*.eps'))
-    pdffiles = glob.glob(os.path.join(_outdir, 'plantuml-*.pdf'))
+    epsfiles = list_images('', '.eps')
+    pdffiles = list_images('', '.pdf')
     assert len(epsfiles) == 1
     assert len(pdffiles) == 1
 
-    epscontent = readfile(epsfiles[0]).splitlines()
-    assert b'-teps' in epscontent[0]
-    assert epscontent[1][2:] == b'Hello'
+    epscmd, epsline = readhead(epsfiles[0])
+    assert b'-teps' in epscmd
+    assert epsline[2:] == b'Hello'
@@ -0,0 +1,35 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from sphinxcontrib import plantuml
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def setup_module():
+    global _tempdir
+    _tempdir = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(_tempdir)
+
+
+def test_get_png_size():
+    fname = os.path.join(_tempdir, 'a.png')
+    Image.new('RGB', (115, 147)).save(fname)
+    assert plantuml._get_png_size(fname) == (115, 147)
+
+
+def test_get_png_size_not_png():
+    fname = os.path.join(_tempdir, 'b.png')
+    Path(fname).write_bytes(b'Hello')
+    with pytest.raises(OSError):
+        plantuml._get_png_size(fname)
+    # failure isn't cached
+    Image.new('RGB', (115, 147)).save(fname)
+    assert plantuml._get_png_size(fname) == (115, 147)
@@ -1,6 +1,7 @@
 import os
 import shutil
 import tempfile
+from pathlib import Path
 
 from sphinxcontrib import plantuml
 
@@ -15,11 +16,7 @@ def teardown_module():
 
 
 def writefile(fname, data):
-    f = open(fname, 'w')
-    try:
-        f.write(data)
-    finally:
-        f.close()
+    Path(fname).write_text(data)
 
 
 def test_get_svg_style():
@@ -31,3 +28,21 @@ def test_get_svg_style():
         'style="width:115px;height:147px;" version="1.1" viewBox="0 0 115 147" '
         'width="115pt"><defs/>')
     assert plantuml._get_svg_style(fname) == 'width:115px;height:147px;'
+
+
+def test_get_svg_style_across_chunks():
+    fname = os.path.join(_tempdir, 'b.svg')
+    writefile(
+        fname,
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<!--' + ' ' * 4000 + '-->'
+        '<svg xmlns="http://www.w3.org/2000/svg" height="147pt" '
+        'style="width:115px;height:147px;" version="1.1" viewBox="0 0 115 147" '
+        'width="115pt"><defs/>')
+    assert plantuml._get_svg_style(fname) == 'width:115px;height:147px;'
+
+
+def test_get_svg_style_not_found():
+    fname = os.path.join(_tempdir, 'c.svg')
+    writefile(fname, '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>')
+    assert plantuml._get_svg_style(fname) is None
@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+import pytest
+from docutils import nodes
+
+from sphinxcontrib import plantuml
+
+
+def make_translator(**config):
+    builder = SimpleNamespace(config=SimpleNamespace(**config))
+    return SimpleNamespace(builder=builder, body=[])
+
+
+def make_node():
+    return plantuml.plantuml('', uml='Hello', incdir='', filename='index.rst')
+
+
+def test_html_visit_no_output():
+    translator = make_translator(plantuml_output_format='none')
+    node = make_node()
+    with pytest.raises(nodes.SkipNode):
+        plantuml.html_visit_plantuml(translator, node)
+    assert translator.body == []
+
+
+def test_latex_visit_no_output():
+    translator = make_translator(plantuml_latex_output_format='none')
+    node = make_node()
+    with pytest.raises(nodes.SkipNode):
+        plantuml.latex_visit_plantuml(translator, node)
+    assert translator.body == []
+    assert len(node.children) == 0